@@ -22,12 +22,17 @@ You must create a new cycle object each time your want to restart the cycle
 (e.g. for a new panel)
 """
 from __future__ import print_function, absolute_import
+from collections import OrderedDict
 from itertools import cycle
 import matplotlib
 import matplotlib.figure
 import numpy as np
 import os
+import struct
+import zlib
+from matplotlib.path import Path
 from matplotlib.ticker import AutoMinorLocator, FormatStrFormatter
+from matplotlib.transforms import Affine2D, Bbox, TransformedPath
 
 cm2inch = 0.39370079
 
@@ -439,16 +444,344 @@ def write_pdf(fig, outfile, dpi=72):
     canvas.print_figure(outfile, dpi=dpi)
 
 
-def write_png(fig, outfile, dpi=72):
+def write_png(fig, outfile, dpi=72, tile_height=None):
     """
     Write a png of the given figure, indendent of the pyplot backend.
     However, if the figure was created from pyplot, an existing pyplot backend
     will be permanently changed and may be dysfunctional.
+
+    If `tile_height` is given, the figure is rendered in horizontal strips of
+    at most `tile_height` pixels, and each strip is streamed directly into the
+    png file (`outfile` may be a filename or a file-like object; an
+    incomplete file is removed if the rendering fails). The peak memory use is
+    then bounded by the size of a single strip (plus at most `dpi` rows)
+    instead of the size of the entire image, which allows to write e.g.
+    poster-size figures at high dpi. Images that are not an `AxesImage` (or
+    that are a `NonUniformImage`/`PcolorImage`) are still resampled at their
+    full size for every strip. The layout engine of the figure (if any) runs
+    only once, before the first strip.
+
+    Each strip is drawn exactly as the same rows of a single-pass render, with
+    one exception: Agg clips all drawing to the rows of the strip in
+    fixed-point arithmetic, which can change the antialiasing of a slanted
+    edge crossing the boundary between two strips by one or two levels (out
+    of 255) in individual pixels along the edge.
+
+    A ValueError is raised for figures that cannot be rendered in strips:
+    figures with Agg filters, quad meshes without face colors, or when the rc
+    parameters `savefig.bbox` or `savefig.transparent` are set.
     """
     from matplotlib.backends.backend_agg \
     import FigureCanvasAgg as FigureCanvas
     canvas = FigureCanvas(fig)
-    canvas.print_figure(outfile, dpi=dpi)
+    if tile_height is None:
+        canvas.print_figure(outfile, dpi=dpi)
+    else:
+        _write_png_tiled(canvas, outfile, dpi, int(tile_height))
+
+
+def _png_chunk(fh, chunk_type, data):
+    """Write a single chunk of a png file to the open file handle `fh`"""
+    fh.write(struct.pack('>I', len(data)))
+    fh.write(chunk_type)
+    fh.write(data)
+    crc = zlib.crc32(chunk_type)
+    crc = zlib.crc32(data, crc)
+    fh.write(struct.pack('>I', crc & 0xffffffff))
+
+
+class _StripRenderer(object):
+    """
+    Proxy for an Agg `renderer` that holds the rows `top` to
+    `top + renderer.height` of a canvas of size `width` x `height`.
+
+    All drawing calls are shifted by the (integer) offset of the strip, so
+    that artists are drawn exactly as on the full canvas. Stroked paths
+    without a face are clipped and simplified against the full canvas here,
+    as Agg would clip them against the strip otherwise (which e.g. restarts
+    the dash pattern at the edge of the strip). Only the final clipping of
+    the rasterized outlines to the rows of the strip remains (see
+    `write_png`).
+    """
+
+    def __init__(self, renderer, width, height, top):
+        self._renderer = renderer
+        self.width = width
+        self.height = height
+        self._top = top
+        # display y-coordinate of the bottom edge of the strip
+        self._bottom = height - top - renderer.height
+        self._shift = Affine2D().translate(0, -self._bottom)
+
+    def __getattr__(self, name):
+        return getattr(self._renderer, name)
+
+    def get_canvas_width_height(self):
+        return self.width, self.height
+
+    def _strip_gc(self, gc):
+        """Return a copy of `gc` with the clipping shifted into the strip"""
+        strip_gc = self._renderer.new_gc()
+        strip_gc.copy_properties(gc)
+        cliprect = gc.get_clip_rectangle()
+        if cliprect is not None:
+            strip_gc.set_clip_rectangle(
+                cliprect.frozen().translated(0, -self._bottom))
+        clippath, clippath_trans = gc.get_clip_path()
+        if clippath is not None:
+            strip_gc.set_clip_path(
+                TransformedPath(clippath, clippath_trans + self._shift))
+        return strip_gc
+
+    def _draw_cleaned(self, gc, path, transform, rgbFace, clip, simplify,
+                      stroke_width):
+        """
+        Draw `path` with the (strip) `gc`, after transforming, clipping,
+        snapping, and simplifying it in the coordinates of the full canvas,
+        exactly as Agg would for a single-pass render. The result is then
+        moved into the strip by an exact integer shift.
+        """
+        flip = Affine2D().scale(1, -1).translate(0, self.height)
+        if clip:
+            clip = ((0, 0), (self.width, self.height))
+        else:
+            clip = None
+        path = path.cleaned(
+            transform + flip, remove_nans=True, clip=clip, simplify=simplify,
+            stroke_width=stroke_width, snap=gc.get_snap(),
+            sketch=gc.get_sketch_params())
+        if len(path.vertices) < 2:
+            return
+        gc.set_snap(False)
+        gc.set_sketch_params(None)
+        if rgbFace is None and gc.get_hatch() is None:
+            # Agg does not clip paths that have a face. An alpha that rounds
+            # to zero in 8-bit color makes the face invisible.
+            rgbFace = (0, 0, 0, 1e-6)
+            gc.set_alpha(None)  # keeps the stroke color, drops forced alpha
+        unflip = (Affine2D().scale(1, -1)
+                  .translate(0, self._renderer.height + self._top))
+        self._renderer.draw_path(gc, path, unflip, rgbFace)
+
+    def draw_path(self, gc, path, transform, rgbFace=None):
+        strip_gc = self._strip_gc(gc)
+        clip = (rgbFace is None and gc.get_hatch() is None)
+        stroke_width = self.points_to_pixels(gc.get_linewidth())
+        if gc.get_rgb()[3] == 0:
+            stroke_width = 0
+        nmax = matplotlib.rcParams['agg.path.chunksize']
+        npts = path.vertices.shape[0]
+        if clip and npts > nmax > 100 and path.should_simplify:
+            # split into chunks like Agg does for a single-pass render
+            nch = np.ceil(npts / float(nmax))
+            chsize = int(np.ceil(npts / nch))
+            starts = list(range(0, npts, chsize))
+            ends = [i0 - 1 for i0 in starts[1:]] + [npts]
+            for (i0, i1) in zip(starts, ends):
+                codes = path.codes
+                if codes is not None:
+                    codes = codes[i0:i1].copy()
+                    codes[0] = Path.MOVETO
+                chunk = Path(path.vertices[i0:i1, :], codes)
+                chunk.simplify_threshold = path.simplify_threshold
+                self._draw_cleaned(strip_gc, chunk, transform, rgbFace,
+                                   clip, True, stroke_width)
+        else:
+            self._draw_cleaned(strip_gc, path, transform, rgbFace, clip,
+                               clip and path.should_simplify, stroke_width)
+        strip_gc.restore()
+
+    def draw_markers(self, gc, marker_path, marker_trans, path, trans,
+                     rgbFace=None):
+        strip_gc = self._strip_gc(gc)
+        self._renderer.draw_markers(strip_gc, marker_path, marker_trans,
+                                    path, trans + self._shift, rgbFace)
+        strip_gc.restore()
+
+    def draw_path_collection(self, gc, master_transform, paths,
+                             all_transforms, offsets, offset_trans,
+                             facecolors, edgecolors, linewidths, linestyles,
+                             antialiaseds, urls, offset_position, **kwargs):
+        if len(facecolors) == 0 and gc.get_hatch() is None:
+            # Agg would clip the stroked paths against the strip, so we
+            # draw them one by one (without simplification, as Agg does
+            # for collections)
+            path_ids = self._iter_collection_raw_paths(
+                master_transform, paths, all_transforms)
+            for xo, yo, path_id, gc0, rgbFace in self._iter_collection(
+                    gc, list(path_ids), offsets, offset_trans, facecolors,
+                    edgecolors, linewidths, linestyles, antialiaseds, urls,
+                    offset_position, **kwargs):
+                path, transform = path_id
+                if xo != 0 or yo != 0:
+                    transform = Affine2D(transform.get_matrix())
+                    transform.translate(xo, yo)
+                strip_gc = self._strip_gc(gc0)
+                self._draw_cleaned(
+                    strip_gc, path, transform, None, True, False,
+                    self.points_to_pixels(gc0.get_linewidth()))
+                strip_gc.restore()
+        else:
+            strip_gc = self._strip_gc(gc)
+            self._renderer.draw_path_collection(
+                strip_gc, master_transform + self._shift, paths,
+                all_transforms, offsets, offset_trans, facecolors,
+                edgecolors, linewidths, linestyles, antialiaseds, urls,
+                offset_position, **kwargs)
+            strip_gc.restore()
+
+    def draw_quad_mesh(self, gc, master_transform, meshWidth, meshHeight,
+                       coordinates, offsets, offsetTrans, facecolors,
+                       antialiased, edgecolors):
+        if len(facecolors) == 0:
+            raise ValueError("Quad meshes without face colors cannot be "
+                             "rendered in strips")
+        strip_gc = self._strip_gc(gc)
+        self._renderer.draw_quad_mesh(
+            strip_gc, master_transform + self._shift, meshWidth, meshHeight,
+            coordinates, offsets, offsetTrans, facecolors, antialiased,
+            edgecolors)
+        strip_gc.restore()
+
+    def draw_gouraud_triangles(self, gc, triangles_array, colors_array,
+                               transform):
+        strip_gc = self._strip_gc(gc)
+        self._renderer.draw_gouraud_triangles(
+            strip_gc, triangles_array, colors_array,
+            transform + self._shift)
+        strip_gc.restore()
+
+    def draw_image(self, gc, x, y, im, transform=None):
+        strip_gc = self._strip_gc(gc)
+        self._renderer.draw_image(strip_gc, x, y - self._bottom, im)
+        strip_gc.restore()
+
+    def draw_text(self, gc, x, y, s, prop, angle, ismath=False, mtext=None):
+        # for text, y is measured from the top of the canvas
+        strip_gc = self._strip_gc(gc)
+        self._renderer.draw_text(strip_gc, x, y - self._top, s, prop, angle,
+                                 ismath=ismath, mtext=mtext)
+        strip_gc.restore()
+
+    def draw_tex(self, gc, x, y, s, prop, angle, mtext=None):
+        strip_gc = self._strip_gc(gc)
+        self._renderer.draw_tex(strip_gc, x, y - self._top, s, prop, angle,
+                                mtext=mtext)
+        strip_gc.restore()
+
+
+def _write_png_tiled(canvas, outfile, dpi, tile_height):
+    """
+    Render the figure of the Agg `canvas` in horizontal strips of
+    `tile_height` pixels and stream the rows into a (RGBA, 8 bit) png file
+    (a filename or a file-like object).
+
+    Each strip is drawn through a `_StripRenderer`. To keep the hatch
+    patterns (which Agg aligns with the top of the renderer) in phase, the
+    renderer of a strip always starts at a multiple of `dpi` rows; the extra
+    rows above the strip are discarded. Images are clipped to the strip, so
+    that they are only resampled for the rows of the strip. The layout engine
+    of the figure (if any) runs before the first strip and is switched off
+    while the strips are drawn, so that all strips share the same layout.
+
+    If writing to a file fails, the incomplete file is removed.
+    """
+    from matplotlib.backends.backend_agg import RendererAgg
+    from matplotlib.image import AxesImage
+    fig = canvas.figure
+    if tile_height < 1:
+        raise ValueError("tile_height must be a positive integer")
+    if matplotlib.rcParams['savefig.bbox'] is not None:
+        raise ValueError("Tiled rendering does not support savefig.bbox")
+    if matplotlib.rcParams['savefig.transparent']:
+        raise ValueError("Tiled rendering does not support "
+                         "savefig.transparent")
+    if fig.findobj(lambda artist: artist.get_agg_filter() is not None):
+        raise ValueError("Tiled rendering does not support Agg filters")
+    images = [(im, im.get_clip_box(), im.get_clip_on())
+              for im in fig.findobj(AxesImage)]
+    layout_engine = fig.get_layout_engine()
+    orig_dpi = fig.dpi
+    orig_facecolor = fig.get_facecolor()
+    orig_edgecolor = fig.get_edgecolor()
+    facecolor = matplotlib.rcParams['savefig.facecolor']
+    edgecolor = matplotlib.rcParams['savefig.edgecolor']
+    if facecolor == 'auto':
+        facecolor = orig_facecolor
+    if edgecolor == 'auto':
+        edgecolor = orig_edgecolor
+    own_file = not hasattr(outfile, 'write')
+    fh = None
+    try:
+        fig.dpi = dpi
+        fig.set_facecolor(facecolor)
+        fig.set_edgecolor(edgecolor)
+        # same pixel size as the canvas in a single-pass render
+        width, height = canvas.get_width_height(physical=True)
+        hatch_size = int(dpi)
+        # layout engines measure text with the canvas renderer
+        renderer = _StripRenderer(RendererAgg(width, 1, dpi), width, height,
+                                  0)
+        canvas.get_renderer = lambda: renderer
+        if layout_engine is not None:
+            fig.draw_without_rendering()  # runs the layout engine
+            fig.set_layout_engine('none')
+        if own_file:
+            fh = open(outfile, 'wb')
+        else:
+            fh = outfile
+        compressor = zlib.compressobj()
+        fh.write(b'\x89PNG\r\n\x1a\n')
+        _png_chunk(fh, b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                            8, 6, 0, 0, 0))
+        ppm = int(round(dpi / 0.0254)) # pixels per meter
+        _png_chunk(fh, b'pHYs', struct.pack('>IIB', ppm, ppm, 1))
+        for top in range(0, height, tile_height):
+            h = min(tile_height, height - top)
+            renderer_top = top - (top % hatch_size)
+            renderer = _StripRenderer(
+                RendererAgg(width, top + h - renderer_top, dpi),
+                width, height, renderer_top)
+            # display y-range of the rows written for this strip
+            y0, y1 = height - top - h, height - top
+            for (im, clipbox, clip_on) in images:
+                if not clip_on:
+                    clipbox = fig.bbox
+                elif clipbox is None:
+                    clipbox = im.axes.bbox
+                x0, x1 = clipbox.x0, clipbox.x1
+                im.set_clip_box(Bbox.from_extents(
+                    x0, max(clipbox.y0, y0), x1,
+                    max(min(clipbox.y1, y1), clipbox.y0, y0)))
+                im.set_clip_on(True)
+            fig.draw(renderer)
+            rows = np.frombuffer(renderer.buffer_rgba(), np.uint8)
+            rows = rows.reshape(-1, width * 4)[top - renderer_top:]
+            for row in rows:
+                data = compressor.compress(b'\x00' + row.tobytes())
+                if data:
+                    _png_chunk(fh, b'IDAT', data)
+            del rows, renderer
+        _png_chunk(fh, b'IDAT', compressor.flush())
+        _png_chunk(fh, b'IEND', b'')
+    except BaseException:
+        if own_file and fh is not None:
+            fh.close()
+            os.remove(outfile)
+        raise
+    finally:
+        if own_file and fh is not None:
+            fh.close()
+        if 'get_renderer' in canvas.__dict__:
+            del canvas.get_renderer
+        if layout_engine is not None:
+            fig.set_layout_engine(layout_engine)
+        for (im, clipbox, clip_on) in images:
+            im.set_clip_box(clipbox)
+            im.set_clip_on(clip_on)
+        fig.dpi = orig_dpi
+        fig.set_facecolor(orig_facecolor)
+        fig.set_edgecolor(orig_edgecolor)
 
 
 def write_eps(fig, outfile, dpi=72):
@@ -473,6 +806,134 @@ def write_figure(fig, outfile, dpi=72):
     writer = {
         'pdf': write_pdf,
         'eps': write_eps,
-        'png': write_eps
+        'png': write_png
     }
     writer[format](fig, outfile, dpi)
+
+
+class FigureTemplate(object):
+    """
+    Template for producing many figures that share the same layout and axis
+    formatting and differ only in their data.
+
+    The figure skeleton (figure, axes, `set_axis` formatting, and the initial
+    artists) is built only once. Each output is then produced by swapping new
+    data into the existing artists and writing the figure to disk, which
+    avoids re-creating the axes, tick locators, and formatters for every
+    figure.
+
+    Parameters
+    ----------
+
+    fig: instance of matplotlib.figure.Figure
+        The fully set up figure
+    artists: dict or list of tuples (name, artist)
+        Mapping of names to the artists (`Line2D` instances as returned by
+        `ax.plot`, or `AxesImage` instances as returned by `ax.imshow`) whose
+        data changes from figure to figure. Give a list of tuples (or an
+        OrderedDict) if the order of the lines matters for `ls_cycle`.
+    ls_cycle: array of strings, optional
+        Line style names passed to `new_ls_cycle`. If given, the cycle is
+        restarted for each figure, and the line styles are applied to the
+        line artists in order.
+    rescale: boolean, optional
+        If True, re-calculate the data limits of all axes and the color limits
+        of all images after the data has been swapped. This has no effect on
+        axes whose range was fixed with `set_axis`, or on the extent of the
+        images. If False, the color limits
+        of the images stay at the values of the image the template was built
+        with.
+
+    Example
+    -------
+
+    >>> fig = mgplottools.mpl.new_figure(10, 4, no_backend=True, quiet=True)
+    >>> ax = fig.add_axes([0.15, 0.2, 0.8, 0.75])
+    >>> mgplottools.mpl.set_axis(ax, 'x', 0, 10, 2, minor=2, label='t')
+    >>> mgplottools.mpl.set_axis(ax, 'y', -1, 1, 0.5, minor=5, label='f')
+    >>> line, = ax.plot([], [])
+    >>> template = mgplottools.mpl.FigureTemplate(fig, {'f': line})
+    >>> for i, (t, f) in enumerate(datasets):
+    >>>     template.write_figure('f%03d.pdf' % i, {'f': (t, f)})
+    """
+
+    def __init__(self, fig, artists, ls_cycle=None, rescale=False):
+        self.fig = fig
+        self.artists = OrderedDict(artists)
+        self.rescale = rescale
+        self._ls_cycle_names = ls_cycle
+        self.reset_ls_cycle()
+
+    def reset_ls_cycle(self):
+        """
+        Restart the linestyle cycle, and apply it to the line artists of the
+        template (if the template was created with `ls_cycle`)
+        """
+        from matplotlib.lines import Line2D
+        if self._ls_cycle_names is None:
+            return
+        ls_cycle = new_ls_cycle(self._ls_cycle_names)
+        for artist in self.artists.values():
+            if isinstance(artist, Line2D):
+                artist.set_dashes(next(ls_cycle))
+
+    def set_data(self, data):
+        """
+        Swap new data into the artists. The `data` must be a mapping of
+        artist names to the new data. For a line, the data must be given as a
+        tuple (x, y) of arrays of the same length, for an image as an array
+        of the same shape as the current image data (the extent of an image
+        is fixed when it is created, so an array of a different shape would be
+        stretched into the old extent).
+
+        All the data is checked before any artist is changed, so if an
+        exception is raised, the template is left unchanged.
+        """
+        from matplotlib.lines import Line2D
+        from matplotlib.image import AxesImage
+        new_data = []
+        for name, value in data.items():
+            try:
+                artist = self.artists[name]
+            except KeyError:
+                raise KeyError("Unknown artist '%s'" % name)
+            if isinstance(artist, Line2D):
+                try:
+                    x, y = value
+                    if len(x) != len(y):
+                        raise ValueError
+                except (TypeError, ValueError):
+                    raise ValueError("Data for line '%s' must be a tuple "
+                                     "(x, y) of arrays of the same length"
+                                     % name)
+                new_data.append((artist, (x, y)))
+            elif isinstance(artist, AxesImage):
+                value = np.asarray(value)
+                shape = artist.get_array().shape
+                if value.shape[:2] != shape[:2]:
+                    raise ValueError("Data for image '%s' must have shape %s, "
+                                     "not %s" % (name, shape[:2],
+                                                 value.shape[:2]))
+                new_data.append((artist, (value, )))
+            else:
+                raise TypeError("Cannot set data for artist '%s' of type %s"
+                                % (name, type(artist).__name__))
+        for (artist, args) in new_data:
+            artist.set_data(*args)
+            if self.rescale and isinstance(artist, AxesImage):
+                artist.autoscale()
+        if self.rescale:
+            for ax in self.fig.axes:
+                ax.relim()
+                ax.autoscale_view()
+        self.reset_ls_cycle()
+
+    def write_figure(self, outfile, data=None, dpi=72):
+        """
+        Swap the given `data` into the template (see `set_data`), and write
+        the resulting figure to outfile (see the module-level `write_figure`)
+        """
+        if data is None:
+            data = {}
+        self.set_data(data)
+        write_figure(self.fig, outfile, dpi)
@@ -0,0 +1,236 @@
+"""
+Tests for mgplottools.mpl
+"""
+import io
+from collections import OrderedDict
+
+import matplotlib
+import numpy as np
+import pytest
+from matplotlib.figure import Figure
+from matplotlib.image import imread
+
+from mgplottools import mpl
+
+
+def new_template_figure():
+    fig = mpl.new_figure(8, 6, no_backend=True, quiet=True)
+    ax = fig.add_axes([0.15, 0.15, 0.8, 0.8])
+    mpl.set_axis(ax, 'x', 0, 10, 2, minor=2, label='t')
+    mpl.set_axis(ax, 'y', -1, 1, 0.5, minor=5, label='f')
+    line, = ax.plot([], [], color='black', lw=2)
+    image = ax.imshow(np.zeros((5, 5)), extent=[6, 9, -0.8, 0.8],
+                      aspect='auto')
+    return fig, line, image
+
+
+def test_template_writes_figures_with_different_data(tmp_path):
+    fig, line, image = new_template_figure()
+    template = mpl.FigureTemplate(fig, [('f', line), ('im', image)],
+                                  rescale=True)
+    x = np.linspace(0, 5, 100)
+    template.write_figure(str(tmp_path / 'a.png'),
+                          {'f': (x, np.sin(x)), 'im': np.random.rand(5, 5)})
+    template.write_figure(str(tmp_path / 'b.png'),
+                          {'f': (x, np.cos(x)), 'im': 5 * np.random.rand(5, 5)})
+    a = imread(str(tmp_path / 'a.png'))
+    b = imread(str(tmp_path / 'b.png'))
+    assert a.shape == b.shape
+    assert (a != b).any()
+    # the figure is reused, not rebuilt
+    assert len(fig.axes) == 1
+    assert len(fig.axes[0].lines) == 1
+    np.testing.assert_array_equal(line.get_ydata(), np.cos(x))
+
+
+def test_template_autoscales_image_color_limits(tmp_path):
+    fig, line, image = new_template_figure()
+    template = mpl.FigureTemplate(fig, {'im': image}, rescale=True)
+    data = 5 * np.random.rand(5, 5)
+    template.set_data({'im': data})
+    assert image.get_clim() == (data.min(), data.max())
+
+    fig, line, image = new_template_figure()
+    template = mpl.FigureTemplate(fig, {'im': image})
+    template.set_data({'im': data})
+    assert image.get_clim() == (0.0, 0.0)
+
+
+def test_template_applies_ls_cycle(tmp_path):
+    fig = mpl.new_figure(8, 6, no_backend=True, quiet=True)
+    ax = fig.add_axes([0.15, 0.15, 0.8, 0.8])
+    lines = [ax.plot([0, 1], [i, i], lw=2)[0] for i in range(3)]
+    template = mpl.FigureTemplate(
+        fig, [('l%d' % i, l) for (i, l) in enumerate(lines)],
+        ls_cycle=['dashed', 'dotted'])
+    template.write_figure(str(tmp_path / 'a.png'))
+    for line in lines:
+        line.set_dashes(mpl.ls['long-dashed'])
+    template.write_figure(str(tmp_path / 'b.png'))
+    a = imread(str(tmp_path / 'a.png'))
+    b = imread(str(tmp_path / 'b.png'))
+    np.testing.assert_array_equal(a, b)
+    ls_cycle = mpl.new_ls_cycle(['dashed', 'dotted'])
+    for line in lines:
+        line.set_dashes(next(ls_cycle))
+    mpl.write_figure(fig, str(tmp_path / 'c.png'))
+    np.testing.assert_array_equal(a, imread(str(tmp_path / 'c.png')))
+
+
+def test_template_invalid_data():
+    fig, line, image = new_template_figure()
+    template = mpl.FigureTemplate(fig, {'f': line, 'text': fig.axes[0].title})
+    with pytest.raises(KeyError):
+        template.set_data({'g': ([0, 1], [0, 1])})
+    with pytest.raises(ValueError) as exc_info:
+        template.set_data({'f': ([0, 1], [0, 1], [0, 1])})
+    assert "'f'" in str(exc_info.value)
+    with pytest.raises(ValueError):
+        template.set_data({'f': ([0, 1, 2], [0, 1])})
+    with pytest.raises(ValueError):
+        template.set_data({'f': 1.0})
+    with pytest.raises(TypeError):
+        template.set_data({'text': 'title'})
+
+
+def test_template_invalid_data_leaves_template_unchanged():
+    fig, line, image = new_template_figure()
+    template = mpl.FigureTemplate(fig, [('f', line), ('im', image)])
+    template.set_data({'f': ([0, 1], [0, 1])})
+    with pytest.raises(KeyError):
+        template.set_data(OrderedDict([('f', ([0, 2], [0, 2])),
+                                       ('g', ([0, 1], [0, 1]))]))
+    with pytest.raises(ValueError):
+        template.set_data(OrderedDict([('f', ([0, 2], [0, 2])),
+                                       ('im', np.ones((3, 3)))]))
+    np.testing.assert_array_equal(line.get_xdata(), [0, 1])
+    np.testing.assert_array_equal(image.get_array(), np.zeros((5, 5)))
+
+
+def test_template_artist_names(tmp_path):
+    fig, line, image = new_template_figure()
+    template = mpl.FigureTemplate(fig, {'dpi': line, 'outfile': image})
+    x = np.linspace(0, 5, 10)
+    template.write_figure(str(tmp_path / 'a.png'),
+                          {'dpi': (x, x), 'outfile': np.ones((5, 5))})
+    np.testing.assert_array_equal(line.get_xdata(), x)
+
+
+def new_tiled_figure():
+    fig = mpl.new_figure(8, 6, no_backend=True, quiet=True)
+    ax = fig.add_axes([0.15, 0.15, 0.8, 0.8])
+    mpl.set_axis(ax, 'x', 0, 10, 2, minor=2, label=r'time $t$')
+    mpl.set_axis(ax, 'y', -1.5, 1.5, 0.5, minor=5, label='f')
+    x = np.linspace(0, 10, 200)
+    ls_cycle = mpl.new_ls_cycle()
+    for i in range(3):
+        ax.plot(x, np.sin(x + i), dashes=next(ls_cycle), lw=1.5)
+    ax.imshow(np.random.RandomState(0).rand(20, 30), extent=[6, 9, -1, 0],
+              aspect='auto')
+    ax.text(1, 1.2, r'rotated $\alpha^2$', rotation=20)
+    fig.text(0.5, 0.5, 'inch', transform=fig.dpi_scale_trans)
+    fig.figimage(np.random.RandomState(1).rand(10, 20), 30, 40)
+    return fig
+
+
+@pytest.mark.parametrize('tile_height', [1, 16, 37, 1000])
+def test_write_png_tiled(tmp_path, tile_height):
+    fig = new_tiled_figure()
+    mpl.write_png(fig, str(tmp_path / 'b.png'), dpi=100,
+                  tile_height=tile_height)
+    mpl.write_png(fig, str(tmp_path / 'a.png'), dpi=100)
+    np.testing.assert_array_equal(imread(str(tmp_path / 'a.png')),
+                                  imread(str(tmp_path / 'b.png')))
+
+
+def test_write_png_tiled_slanted_edges(tmp_path):
+    fig = mpl.new_figure(8, 6, no_backend=True, quiet=True)
+    fig.text(0.3, 0.3, 'box', rotation=30, bbox=dict(fc='y'))
+    mpl.write_png(fig, str(tmp_path / 'a.png'), dpi=100)
+    mpl.write_png(fig, str(tmp_path / 'b.png'), dpi=100, tile_height=1)
+    a = imread(str(tmp_path / 'a.png'))
+    b = imread(str(tmp_path / 'b.png'))
+    assert np.abs(a - b).max() <= 2 / 255.0 + 1e-6
+
+
+def assert_tiled_equal(new_fig, tmp_path, tile_heights=(1, 16, 37)):
+    """Check that `new_fig()` renders the same with and without tiling"""
+    mpl.write_png(new_fig(), str(tmp_path / 'a.png'), dpi=100)
+    a = imread(str(tmp_path / 'a.png'))
+    for tile_height in tile_heights:
+        mpl.write_png(new_fig(), str(tmp_path / 'b.png'), dpi=100,
+                      tile_height=tile_height)
+        np.testing.assert_array_equal(a, imread(str(tmp_path / 'b.png')))
+
+
+def test_write_png_tiled_size(tmp_path):
+    # 4.1 inch at 100 dpi is just below 410 pixels in floating point
+    assert_tiled_equal(lambda: Figure(figsize=(4.1, 3.3)), tmp_path)
+    assert imread(str(tmp_path / 'b.png')).shape == (330, 410, 4)
+
+
+@pytest.mark.parametrize('layout', ['constrained', 'tight'])
+def test_write_png_tiled_layout(tmp_path, layout):
+    def new_fig():
+        fig = Figure(figsize=(4, 3), layout=layout)
+        for i, ax in enumerate(fig.subplots(2, 2).flat):
+            ax.plot([0, 1], [0, 10**i])
+            ax.set_ylabel('label %d' % 10**i)
+            ax.imshow(np.random.RandomState(i).rand(4, 4), aspect='auto',
+                      extent=[0, 0.5, 0, 10**i])
+        return fig
+    assert_tiled_equal(new_fig, tmp_path, tile_heights=(50, ))
+
+
+def test_write_png_tiled_file_like(tmp_path):
+    fig = new_tiled_figure()
+    mpl.write_png(fig, str(tmp_path / 'a.png'), dpi=100, tile_height=16)
+    buffer = io.BytesIO()
+    mpl.write_png(fig, buffer, dpi=100, tile_height=16)
+    with open(str(tmp_path / 'a.png'), 'rb') as in_fh:
+        assert buffer.getvalue() == in_fh.read()
+
+
+def test_write_png_tiled_collections(tmp_path):
+    def new_fig():
+        fig = mpl.new_figure(8, 6, no_backend=True, quiet=True)
+        ax = fig.add_axes([0.15, 0.15, 0.8, 0.8])
+        ax.hlines([0.2, 0.5], 0.1, 0.9, linestyles='dashed', lw=2)
+        ax.vlines([0.3, 0.6], 0.1, 0.9, linestyles='dotted')
+        ax.scatter([0.2, 0.4, 0.6], [0.7, 0.3, 0.5], s=200, facecolor='none',
+                   edgecolor='r')
+        ax.pcolormesh(np.linspace(0.7, 0.9, 5), np.linspace(0.1, 0.4, 4),
+                      np.random.RandomState(0).rand(3, 4))
+        return fig
+    assert_tiled_equal(new_fig, tmp_path)
+
+
+def test_write_png_tiled_chunked_path(tmp_path):
+    def new_fig():
+        fig = mpl.new_figure(8, 6, no_backend=True, quiet=True)
+        ax = fig.add_axes([0.15, 0.15, 0.8, 0.8])
+        x = np.linspace(0, 10, 5000)
+        ax.plot(x, np.sin(x) + 0.1 * np.random.RandomState(0).randn(5000),
+                dashes=(4, 2))
+        return fig
+    with matplotlib.rc_context({'agg.path.chunksize': 1000}):
+        assert_tiled_equal(new_fig, tmp_path)
+
+
+def test_write_png_tiled_unsupported(tmp_path):
+    outfile = str(tmp_path / 'a.png')
+    fig = new_tiled_figure()
+    fig.axes[0].lines[0].set_agg_filter(lambda im, dpi: (im, 0, 0))
+    with pytest.raises(ValueError):
+        mpl.write_png(fig, outfile, tile_height=16)
+    for rc in ({'savefig.bbox': 'tight'}, {'savefig.transparent': True}):
+        with matplotlib.rc_context(rc):
+            with pytest.raises(ValueError):
+                mpl.write_png(new_tiled_figure(), outfile, tile_height=16)
+    fig = new_tiled_figure()
+    fig.axes[0].pcolormesh(np.random.rand(3, 4), facecolor='none',
+                           edgecolor='k')
+    with pytest.raises(ValueError):
+        mpl.write_png(fig, outfile, tile_height=16)
+    # the incomplete file is removed
+    assert not (tmp_path / 'a.png').exists()